@@ -3,16 +3,17 @@ import sys
 import os
 import threading
 import logging
-from langchain_google_genai import ChatGoogleGenerativeAI
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from bootstrap import db
 from chat_storage import save_chat, get_chat_history
 from models.recommender import main_recommender
 from models.purchase import (
+    PURCHASE_USER_FIELDS,
     handle_user_request, 
-    get_chat_history, 
-    save_chat,
-    parse_user_request,
+    respond_and_parse,
     search_books,
     fetch_book_details,
     get_price_info
@@ -20,27 +21,26 @@ from models.purchase import (
 from models.searching import main_search
 from flasgger import Swagger
 from flask_cors import CORS
-import firebase_admin
-from firebase_admin import credentials, firestore
 from models.voice import VoiceQueryHandler, main_voice
 from models.searching import generate_recommendations
 
-# Initialize Firebase
-if not firebase_admin._apps:  # Prevent reinitialization error
-    cred = credentials.Certificate("FIREBASE_CREDENTIALS_PATH")
-    firebase_admin.initialize_app(cred)
-
-# Firestore client
-db = firestore.client()
-
-# Initialize Google Generative AI
-model = ChatGoogleGenerativeAI(
-    model=os.getenv("GENAI_MODEL", "gemini-1.5-flash"),
-    temperature=float(os.getenv("GENAI_TEMPERATURE", 0)),
-    max_tokens=int(os.getenv("GENAI_MAX_TOKENS", 1024)),
-    timeout=int(os.getenv("GENAI_TIMEOUT", 60)),
-    max_retries=int(os.getenv("GENAI_MAX_RETRIES", 5)),
-)
+# Worker pool for /chat: independent lookups run side by side and chat writes run in the background
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("CHAT_WORKERS", 8)))
+
+def _log_failure(future):
+    """Done-callback for tasks nobody waits on, so their errors still show up in the logs."""
+    error = future.exception()
+    if error is not None:
+        logging.error(f"Background chat save failed: {str(error)}")
+
+def save_chat_in_background(user_id, message, role):
+    """Store a chat message on the worker pool without waiting for ChromaDB."""
+    executor.submit(save_chat, user_id, message, role).add_done_callback(_log_failure)
+
+def get_user_data(user_id):
+    """Fetch the purchase-related fields of the user's Firestore document as a dict."""
+    user_ref = db.collection("users").document(user_id)
+    return user_ref.get(field_paths=PURCHASE_USER_FIELDS).to_dict() or {}
 
 app = Flask(__name__)
 swagger = Swagger(app)
@@ -56,6 +56,8 @@ def save_chat_message():
 
     if not user_id or not message:
         return jsonify({"error": "Missing user_id or message"}), 400
+    if not all(isinstance(value, str) for value in (user_id, message, role)):
+        return jsonify({"error": "user_id, message and role must be strings"}), 400
 
     save_chat(user_id, message, role)
     return jsonify({"status": "success"})
@@ -67,7 +69,7 @@ def get_chat():
     if not user_id:
         return jsonify({"error": "Missing user_id"}), 400
 
-    history = get_chat_history(user_id)
+    history = get_chat_history(user_id, limit=1000)
     return jsonify(history)
 
 
@@ -129,6 +131,9 @@ def chat():
     if not user_id or not message:
         return jsonify({"error": "user_id and message are required"}), 400
 
+    # Loading the user profile doesn't depend on the chat reply
+    user_future = executor.submit(get_user_data, user_id)
+
     # Retrieve the chat history for the user
     chat_history = get_chat_history(user_id, limit=10)  # Adjust limit as needed
 
@@ -139,15 +144,11 @@ def chat():
     prompt = "\n".join([f"{msg['role']}: {msg['message']}" for msg in chat_history])
     prompt += f"\nuser: {message}"
 
-    # Generate a response using the model
-    result = model.invoke(prompt)
-    response = result.content
+    # Generate a response and parse the user's request (for book purchase logic) in one model call
+    response, parsed_request = respond_and_parse(prompt, message)
 
-    # Save the AI response to ChromaDB
-    save_chat(user_id, response, role="assistant")
-
-    # Parse the user's request (for book purchase logic)
-    parsed_request = parse_user_request(message)
+    # Save the AI response to ChromaDB without holding up the reply
+    save_chat_in_background(user_id, response, "assistant")
 
     if parsed_request["quantity"] > 0 and parsed_request["topic"] != "Null":
         # This is a book purchase request
@@ -160,17 +161,17 @@ def chat():
 
         if not found_books:
             response = f"I couldn't find any books about '{topic}'. Please try a different topic."
-            save_chat(user_id, response, role="assistant")
+            save_chat_in_background(user_id, response, "assistant")
             return jsonify({"message": response, "books": [], "purchase_details": []})
 
         # Get user details from Firebase
-        user_ref = db.collection("users").document(user_id)
-        user_data = user_ref.get().to_dict() or {}
+        user_data = user_future.result()
 
         # Filter out books the user already owns
+        owned = set(user_data.get("owned_books", []))
         filtered_books = [
             book for book in found_books
-            if book["title"] not in user_data.get("owned_books", [])
+            if book["title"] not in owned
         ]
 
         # Prepare purchase details for the requested quantity
@@ -188,7 +189,7 @@ def chat():
             })
 
         response = f"You can now go to the basket to confirm payment."
-        save_chat(user_id, response, role="assistant")
+        save_chat_in_background(user_id, response, "assistant")
         return jsonify({
             "message": response,
             "requested_quantity": quantity,
@@ -201,20 +202,37 @@ def chat():
         return jsonify({"message": response, "books": [], "purchase_details": []})
 
 
+# Voice sessions started through /start-voice run on daemon threads (so shutdown never waits
+# for a session that is still listening), at most VOICE_WORKERS at a time
+VOICE_WORKERS = int(os.getenv("VOICE_WORKERS", 4))
+voice_slots = threading.BoundedSemaphore(VOICE_WORKERS)
+
+def _run_voice_session(task_id):
+    try:
+        main_voice()
+    except Exception as e:
+        logging.error(f"Voice interaction {task_id} failed: {str(e)}")
+    finally:
+        voice_slots.release()
+
 @app.route('/start-voice', methods=['GET'])
 def start_voice():
     """API route to start the voice interaction in a separate thread"""
+    if not voice_slots.acquire(blocking=False):
+        return jsonify({"error": "Too many voice interactions in progress"}), 429
     try:
-        thread = threading.Thread(target=main_voice)
+        task_id = str(uuid.uuid4())
+        thread = threading.Thread(target=_run_voice_session, args=(task_id,), name=f"voice-{task_id}")
         thread.daemon = True  # Daemonize thread to allow graceful shutdown
         thread.start()
-        return jsonify({"message": "Voice interaction started"}), 200
+        return jsonify({"message": "Voice interaction started", "task_id": task_id}), 202
     except Exception as e:
+        voice_slots.release()
         logging.error(f"Error starting voice interaction: {str(e)}")
         return jsonify({"error": "Failed to start voice interaction"}), 500
     
 
-voice_assistant = VoiceQueryHandler(lambda user_id, query: {"found_books": generate_recommendations(user_id, query)})
+voice_assistant = VoiceQueryHandler(lambda user_id, query: {"found_books": generate_recommendations(query)})
 
 ## done (voice)
 @app.route("/start-voice-assistant")
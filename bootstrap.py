@@ -0,0 +1,19 @@
+from dotenv import load_dotenv
+from models._clients import get_genai_model
+import firebase_admin
+from firebase_admin import credentials, firestore
+import os
+
+# Load environment variables
+load_dotenv()
+
+# Initialize Firebase once per process
+if not firebase_admin._apps:  # Prevent reinitialization error
+    cred = credentials.Certificate(os.getenv("FIREBASE_CREDENTIALS_PATH"))
+    firebase_admin.initialize_app(cred)
+
+# Firestore client
+db = firestore.client()
+
+# Shared Google Generative AI client
+model = get_genai_model()
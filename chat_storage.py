@@ -1,31 +1,197 @@
 from config.config import chat_collection
-from sentence_transformers import SentenceTransformer
+from models._clients import EMBEDDING_MODEL, get_sentence_transformer
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import os
+import numpy as np
+import queue
+import threading
+import time
 import uuid
 
-model = SentenceTransformer("all-MiniLM-L6-v2")  # Convert chat messages into vector embeddings
+model = get_sentence_transformer()  # Convert chat messages into vector embeddings
 
-def save_chat(user_id, message, role="user"):
-    chat_id = str(uuid.uuid4())  # Generate a unique chat ID
-    embedding = model.encode(message).tolist()
+MAX_BATCH = 32  # Max messages per encode call
+MAX_WAIT_MS = 15  # How long the batcher waits for more messages
+SAVE_TIMEOUT = 30  # Max seconds save_chat waits for its message to be stored
+EMBEDDING_CACHE_SIZE = 4096  # Max cached message embeddings
+EMBEDDING_DTYPE = np.float16  # Precision embeddings are kept and stored at
+
+# LRU cache of message embeddings, keyed by model name + normalized text
+_embedding_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
+def _cache_key(text):
+    # all-MiniLM-L6-v2 is uncased, so lowercasing does not change the embedding
+    normalized = text.strip().lower()
+    return hashlib.sha256(f"{EMBEDDING_MODEL}:{normalized}".encode("utf-8")).hexdigest()
+
+def encode_cached(texts):
+    """Encode a list of texts, running the model only for texts not seen recently.
+
+    Embeddings are rounded to EMBEDDING_DTYPE, which halves the cache's memory and makes
+    cached and freshly computed vectors identical.
+    """
+    keys = [_cache_key(text) for text in texts]
+    embeddings = [None] * len(texts)
+    misses = []
+
+    with _embedding_cache_lock:
+        for i, key in enumerate(keys):
+            if key in _embedding_cache:
+                _embedding_cache.move_to_end(key)
+                embeddings[i] = _embedding_cache[key]
+            else:
+                misses.append(i)
+
+    if misses:
+        encoded = model.encode(
+            [texts[i] for i in misses],
+            batch_size=MAX_BATCH,
+            convert_to_numpy=True,
+        ).astype(EMBEDDING_DTYPE)
+        with _embedding_cache_lock:
+            for i, embedding in zip(misses, encoded):
+                embeddings[i] = embedding
+                _embedding_cache[keys[i]] = embedding
+                _embedding_cache.move_to_end(keys[i])
+            while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+                _embedding_cache.popitem(last=False)
 
-    # Store chat message in ChromaDB
+    return embeddings
+
+# Messages stored per user, seeded from ChromaDB the first time a user's history is read
+HISTORY_SLACK = 20  # Extra rows get_chat_history reads past the expected end
+_message_counts = {}
+_message_counts_lock = threading.Lock()
+
+# Micro-batching: concurrent save_chat calls are grouped into a single encode + add
+_pending = queue.Queue()
+
+def _drain_batch():
+    """Block for the first pending message, then collect more for up to MAX_WAIT_MS."""
+    batch = [_pending.get()]
+    deadline = time.monotonic() + MAX_WAIT_MS / 1000
+    while len(batch) < MAX_BATCH:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(_pending.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+def _store_batch(batch):
+    """Encode and add a batch of pending messages to ChromaDB, returning their embeddings."""
+    # Longest first so similar lengths share a padding bucket
+    batch.sort(key=lambda item: len(item[1]), reverse=True)
+    embeddings = encode_cached([message for _, message, _, _, _ in batch])
+
+    # Store all chat messages of the batch in ChromaDB
     chat_collection.add(
-        ids=[chat_id], 
-        embeddings=[embedding], 
-        metadatas=[{"user_id": user_id, "message": message, "role": role}]
+        ids=[str(uuid.uuid4()) for _ in batch],  # Generate a unique chat ID per message
+        embeddings=[embedding.tolist() for embedding in embeddings],
+        metadatas=[
+            {"user_id": user_id, "message": message, "role": role, "timestamp": timestamp}
+            for user_id, message, role, timestamp, _ in batch
+        ]
     )
 
+    with _message_counts_lock:
+        for user_id, *_ in batch:
+            if user_id in _message_counts:
+                _message_counts[user_id] += 1
+    return embeddings
+
+def _batch_worker():
+    while True:
+        batch = _drain_batch()
+        try:
+            embeddings = _store_batch(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][-1].set_exception(e)
+                continue
+            # Retry one by one, so only the caller whose message fails gets the error
+            for item in batch:
+                try:
+                    item[-1].set_result(_store_batch([item])[0])
+                except Exception as item_error:
+                    item[-1].set_exception(item_error)
+        else:
+            for (*_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+# The worker is started on first use and again in each forked child, which does not inherit threads
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+def _ensure_worker():
+    global _pending, _worker_pid
+    pid = os.getpid()
+    if _worker_pid != pid:
+        with _worker_lock:
+            if _worker_pid != pid:
+                _pending = queue.Queue()  # Messages queued in the parent belong to the parent's worker
+                threading.Thread(target=_batch_worker, daemon=True).start()
+                _worker_pid = pid
+
+def save_chat(user_id, message, role="user"):
+    # Checked up front so a bad message never reaches the batch other callers share
+    for name, value in (("user_id", user_id), ("message", message), ("role", role)):
+        if not isinstance(value, str):
+            raise TypeError(f"{name} must be a string, got {type(value).__name__}")
+
+    _ensure_worker()
+    future = Future()
+    _pending.put((user_id, message, role, time.time(), future))
+    future.result(timeout=SAVE_TIMEOUT)  # Wait until the message is stored, as before
+
+def _count_messages(user_id):
+    # Ids-only read of all the user's messages; done once per user and process, or when the count is stale
+    count = len(chat_collection.get(where={"user_id": user_id}, include=[])["ids"])
+    with _message_counts_lock:
+        _message_counts[user_id] = count
+    return count
+
 def get_chat_history(user_id, limit=5):
-    # Query ChromaDB for the last 'limit' messages from the user
+    """Return the user's newest 'limit' messages, oldest first, with a single metadata-filtered read.
+
+    ChromaDB returns matches in insertion order, so the read skips past the older messages using a
+    per-process message count. HISTORY_SLACK extra rows absorb messages saved by other processes;
+    a full or short page means the count is stale, and it is recounted.
+    """
+    with _message_counts_lock:
+        count = _message_counts.get(user_id)
+    if count is None:
+        count = _count_messages(user_id)
+
+    for attempt in range(2):
+        offset = max(count - limit, 0)
+        metadatas = chat_collection.get(
+            where={"user_id": user_id},
+            limit=limit + HISTORY_SLACK,
+            offset=offset,
+            include=["metadatas"]
+        )["metadatas"]
+        stale = len(metadatas) == limit + HISTORY_SLACK or (offset > 0 and len(metadatas) < limit)
+        if not stale or attempt:
+            break
+        count = _count_messages(user_id)
+
+    # Batches are written longest message first, so restore the order the messages were saved in
+    metadatas.sort(key=lambda metadata: metadata.get("timestamp", 0))
+    return metadatas[-limit:]
+
+def search_chat_history(user_id, query, limit=5):
+    # Semantic search over the user's messages; the user_id filter is applied inside ChromaDB
     results = chat_collection.query(
-        query_embeddings=[[0] * model.get_sentence_embedding_dimension()],  # Dummy query vector
-        n_results=limit
+        query_embeddings=[encode_cached([query])[0].tolist()],
+        where={"user_id": user_id},
+        n_results=limit,
+        include=["metadatas"]
     )
-    
-    # Filter results to return only messages from the specified user
-    chat_history = [
-        metadata for metadata in results["metadatas"][0]
-        if metadata["user_id"] == user_id
-    ]
-
-    return chat_history
+
+    return results["metadatas"][0]
@@ -0,0 +1,111 @@
+from cachetools import TTLCache
+from threading import Lock
+import os
+import re
+
+try:
+    import diskcache
+except ImportError:  # The on-disk layer is optional
+    diskcache = None
+
+# Directory for the persistent cache (e.g. ~/.cache/bookini); unset keeps lookups in memory only
+BOOK_CACHE_DIR = os.getenv("BOOK_CACHE_DIR")
+DISK_TTL = 7 * 86400  # Seconds a found book stays on disk
+
+_NON_WORD = re.compile(r"\W+")
+
+_disk = None
+_disk_lock = Lock()
+
+def normalize_title(title):
+    """Lowercase a title and collapse punctuation/whitespace so near-identical titles share a cache entry."""
+    return _NON_WORD.sub(" ", title.strip().lower()).strip()
+
+def _get_disk():
+    global _disk
+    if _disk is None and BOOK_CACHE_DIR and diskcache is not None:
+        with _disk_lock:
+            if _disk is None:
+                _disk = diskcache.Cache(os.path.expanduser(BOOK_CACHE_DIR))
+    return _disk
+
+class BookDetailsCache:
+    """
+    Cache for Google Books lookups keyed by normalized title.
+    Found books live in memory for a day (and on disk for a week when BOOK_CACHE_DIR is set),
+    misses are remembered in memory for 10 minutes.
+    """
+
+    def __init__(self, namespace, maxsize=10000, ttl=86400, miss_maxsize=5000, miss_ttl=600):
+        self.namespace = namespace  # Keeps differently shaped detail dicts apart on disk
+        self._found = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._missing = TTLCache(maxsize=miss_maxsize, ttl=miss_ttl)
+        self._lock = Lock()
+
+    def get_or_fetch(self, title, fetch):
+        """
+        Return cached details for title, calling fetch(title) only when nothing is cached.
+        fetch returns None for a title Google Books doesn't know, which is cached as a miss;
+        an exception from fetch (timeouts, errors) is passed on and nothing is cached.
+        """
+        key = normalize_title(title)
+        found, details = self._lookup(key)
+        if found:
+            return details
+
+        details = fetch(title)
+        self._store(key, details)
+        return details
+
+    def get_many_or_fetch(self, titles, fetch_many):
+        """
+        Like get_or_fetch for several titles: returns details in the order of titles,
+        fetching every uncached title with a single fetch_many(titles) -> {title: details} call.
+        Titles left out of fetch_many's result (failed lookups) come back as None and are not cached.
+        """
+        results = {}
+        uncached = []
+        for title in titles:
+            found, details = self._lookup(normalize_title(title))
+            if found:
+                results[title] = details
+            else:
+                uncached.append(title)
+
+        if uncached:
+            fetched = fetch_many(uncached)
+            for title in uncached:
+                results[title] = fetched.get(title)
+                if title in fetched:
+                    self._store(normalize_title(title), results[title])
+
+        return [results[title] for title in titles]
+
+    def _lookup(self, key):
+        """Return (found, details); found is False when the title has to be fetched."""
+        with self._lock:
+            if key in self._missing:
+                return True, None
+            details = self._found.get(key)
+        if details is not None:
+            return True, details
+
+        disk = _get_disk()
+        if disk is not None:
+            details = disk.get(f"{self.namespace}:{key}")
+            if details is not None:
+                with self._lock:
+                    self._found[key] = details
+                return True, details
+        return False, None
+
+    def _store(self, key, details):
+        with self._lock:
+            if details:
+                self._found[key] = details
+            else:
+                self._missing[key] = True
+
+        disk = _get_disk()
+        if details and disk is not None:
+            disk.set(f"{self.namespace}:{key}", details, expire=DISK_TTL)
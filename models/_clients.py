@@ -0,0 +1,98 @@
+from langchain_google_genai import ChatGoogleGenerativeAI
+from sentence_transformers import SentenceTransformer
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+import os
+import requests
+import threading
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_DIMENSION = 384  # Must match the vectors already stored in the chat_history collection
+HTTP_TIMEOUT = (3, 10)  # (connect, read) seconds for requests made through the shared session
+DETAILS_WORKERS = 8  # Concurrent Google Books lookups across all searches
+
+# Shared per-process clients, created on first use
+_genai_model = None
+_sentence_transformer = None
+_http_session = None
+_details_pool = None
+_lock = threading.Lock()
+
+def _load_sentence_transformer(backend):
+    """Load the SentenceTransformer used to convert chat messages into vector embeddings."""
+    if backend == "onnx":
+        return SentenceTransformer(
+            EMBEDDING_MODEL,
+            backend="onnx",
+            model_kwargs={"file_name": "onnx/model_qint8_avx512_vnni.onnx"},
+        )
+    if backend == "openvino":
+        return SentenceTransformer(EMBEDDING_MODEL, backend="openvino")
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+def get_genai_model():
+    """Return the process-wide Gemini chat model."""
+    global _genai_model
+    if _genai_model is None:
+        with _lock:
+            if _genai_model is None:
+                _genai_model = ChatGoogleGenerativeAI(
+                    model=os.getenv("GENAI_MODEL", "gemini-1.5-flash"),
+                    temperature=float(os.getenv("GENAI_TEMPERATURE", 0)),
+                    max_tokens=int(os.getenv("GENAI_MAX_TOKENS", 1024)),
+                    timeout=int(os.getenv("GENAI_TIMEOUT", 60)),
+                    max_retries=int(os.getenv("GENAI_MAX_RETRIES", 5)),
+                )
+    return _genai_model
+
+def get_sentence_transformer():
+    """Return the process-wide SentenceTransformer embedding model."""
+    global _sentence_transformer
+    if _sentence_transformer is None:
+        with _lock:
+            if _sentence_transformer is None:
+                # EMBEDDING_BACKEND: "onnx" (int8-quantized, default), "openvino" (Intel CPUs) or "torch" (FP32)
+                backend = os.getenv("EMBEDDING_BACKEND", "onnx")
+                try:
+                    model = _load_sentence_transformer(backend)
+                except Exception as e:
+                    if backend == "torch":
+                        raise
+                    # The onnx/openvino backends need the optional packages in requirements-optional.txt
+                    print(f"Embedding backend '{backend}' unavailable, falling back to torch: {str(e)}")
+                    backend = "torch"
+                    model = _load_sentence_transformer(backend)
+                if model.get_sentence_embedding_dimension() != EMBEDDING_DIMENSION:
+                    raise RuntimeError(
+                        f"Embedding backend '{backend}' produces "
+                        f"{model.get_sentence_embedding_dimension()}-d vectors, expected {EMBEDDING_DIMENSION}"
+                    )
+                _sentence_transformer = model
+    return _sentence_transformer
+
+def get_http_session():
+    """Return the process-wide requests.Session, keeping connections to Google Books alive."""
+    global _http_session
+    if _http_session is None:
+        with _lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=20,
+                    pool_maxsize=20,
+                    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http_session = session
+    return _http_session
+
+def get_details_pool():
+    """Return the process-wide worker pool that runs Google Books lookups for every search."""
+    global _details_pool
+    if _details_pool is None:
+        with _lock:
+            if _details_pool is None:
+                _details_pool = ThreadPoolExecutor(max_workers=DETAILS_WORKERS, thread_name_prefix="book-details")
+    return _details_pool
@@ -1,74 +1,33 @@
-from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema import AIMessage, HumanMessage, SystemMessage
 import os
 import sys
 import requests
 import json
-import firebase_admin
-from firebase_admin import credentials, firestore
+import orjson
 from typing import Dict, List, Optional, Tuple
 import re
 
 # Import ChromaDB functions
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config.config import chat_collection
-from sentence_transformers import SentenceTransformer
-import uuid
-
-# Load environment variables
-load_dotenv()
-
-# Initialize Firebase
-cred = credentials.Certificate(os.getenv("FIREBASE_CREDENTIALS_PATH"))
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(cred)
-db = firestore.client()
-
-# Initialize Google Generative AI
-model = ChatGoogleGenerativeAI(
-    model=os.getenv("GENAI_MODEL", "gemini-1.5-flash"),
-    temperature=float(os.getenv("GENAI_TEMPERATURE", 0)),
-    max_tokens=int(os.getenv("GENAI_MAX_TOKENS", 1024)),
-    timeout=int(os.getenv("GENAI_TIMEOUT", 60)),
-    max_retries=int(os.getenv("GENAI_MAX_RETRIES", 5)),
-)
+from bootstrap import db, model
+from chat_storage import save_chat, get_chat_history
+from models._clients import HTTP_TIMEOUT, get_details_pool, get_http_session
+from models._book_cache import BookDetailsCache, normalize_title
+import difflib
 
-# Initialize SentenceTransformer for embeddings
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
-
-def save_chat(user_id, message, role="user"):
-    chat_id = str(uuid.uuid4())  # Generate a unique chat ID
-    embedding = embedding_model.encode(message).tolist()
-
-    # Store chat message in ChromaDB
-    chat_collection.add(
-        ids=[chat_id], 
-        embeddings=[embedding], 
-        metadatas=[{"user_id": user_id, "message": message, "role": role}]
-    )
-
-def get_chat_history(user_id, limit=1000):
-    # Query ChromaDB for the last 'limit' messages from the user
-    results = chat_collection.query(
-        query_embeddings=[[0] * embedding_model.get_sentence_embedding_dimension()],  # Dummy query vector
-        n_results=limit
-    )
-    
-    # Filter results to return only messages from the specified user
-    chat_history = [
-        metadata for metadata in results["metadatas"][0]
-        if metadata["user_id"] == user_id
-    ]
+# User document fields needed to prepare purchase details
+PURCHASE_USER_FIELDS = ["owned_books", "preferred_format", "default_payment", "default_address"]
 
-    return chat_history
+# First two cells of a markdown table row, and the cell pattern of its separator row
+_TABLE_ROW = re.compile(r"^[ \t]*\|[ \t]*([^|\n]+?)[ \t]*\|[ \t]*([^|\n]+?)[ \t]*\|", re.MULTILINE)
+_SEPARATOR_CELL = re.compile(r":?-+:?")
 
-def parse_user_request(request_text: str) -> Dict:
-    """
-    Use Gemini to parse the user's request and determine if it's a book purchase request.
-    If it is, return a JSON object with quantity and topic. Otherwise, return None.
-    """
-    prompt = f"""Analyze this user request: '{request_text}'
+def _is_book_row(title):
+    """Tell data rows apart from the header and separator rows of a Title/Author table."""
+    return title.lower() != "title" and not _SEPARATOR_CELL.fullmatch(title)
+
+# Gemini prompt templates, filled in with str.format
+_PARSE_PROMPT = """Analyze this user request: '{request_text}'
     If the request is about buying books, respond with ONLY a valid JSON object in this exact format:
     {{"quantity": <number>, "topic": "<description>"}}
     
@@ -88,6 +47,48 @@ def parse_user_request(request_text: str) -> Dict:
     Input: "hello"
     Output: {{"quantity": 0, "topic": "Null"}}
     """
+
+_CHAT_PROMPT = """You are a helpful book shop assistant. Here is the conversation so far:
+    {conversation}
+
+    Respond with ONLY a valid JSON object in this exact format:
+    {{"chat_response": "<your reply to the user>", "book_intent": {{"quantity": <number>, "topic": "<description>"}}}}
+
+    Rules for book_intent, based on the last user request: '{request_text}'
+    - quantity must be a valid number (default to 1 if not specified).
+    - if the request is not about buying books, set quantity to 0 and topic to "Null".
+    - topic should be the search terms for the book (if applicable).
+    - remove words like "buy me" or "get me" from the topic.
+    - remove the quantity words from the topic.
+    - handle typos in the query (in quantity and topic)
+
+    Example book_intent values:
+    Input: "buy me three books about dragons"
+    Output: {{"quantity": 3, "topic": "dragons"}}
+
+
+    Input: "hello"
+    Output: {{"quantity": 0, "topic": "Null"}}
+    """
+
+_SEARCH_PROMPT = (
+    "You are a helpful book recommendation assistant. The user is looking for books about: '{query}'.\n\n"
+    "Please provide a markdown table with two columns: 'Title' and 'Author'. "
+    "Return only the table without any extra commentary. Give me 5 relevant books."
+)
+
+SESSION = get_http_session()
+GOOGLE_BOOKS_URL = "https://www.googleapis.com/books/v1/volumes"
+
+# Kept apart from searching.py's cache, which stores details with capitalized keys
+_book_cache = BookDetailsCache("purchase")
+
+def parse_user_request(request_text: str) -> Dict:
+    """
+    Use Gemini to parse the user's request and determine if it's a book purchase request.
+    If it is, return a JSON object with quantity and topic. Otherwise, return None.
+    """
+    prompt = _PARSE_PROMPT.format(request_text=request_text)
     
     try:
         result = model.invoke(prompt)
@@ -110,68 +111,145 @@ def parse_user_request(request_text: str) -> Dict:
         print(f"Error in parse_user_request: {str(e)}")
         return {"quantity": 0, "topic": "Null"}  # Fallback to default values
 
+def respond_and_parse(conversation: str, request_text: str) -> Tuple[str, Dict]:
+    """
+    Use a single Gemini call to both reply to the conversation and parse the latest user request.
+    Returns the chat reply and a dict with quantity and topic, as parse_user_request does.
+    """
+    prompt = _CHAT_PROMPT.format(conversation=conversation, request_text=request_text)
+
+    try:
+        result = model.invoke(prompt, generation_config={"response_mime_type": "application/json"})
+    except Exception as e:
+        print(f"Error in respond_and_parse: {str(e)}")
+        return "I'm sorry, I couldn't process your request right now.", {"quantity": 0, "topic": "Null"}
+    response_text = result.content.strip()
+
+    try:
+        parsed = json.loads(response_text)
+        chat_response = parsed["chat_response"]
+        if not isinstance(chat_response, str):
+            raise TypeError("chat_response must be a string")
+    except (json.JSONDecodeError, KeyError, TypeError):
+        print("Error: Gemini returned invalid JSON. Using the raw reply and default values.")
+        return response_text, {"quantity": 0, "topic": "Null"}  # Fallback to default values
+
+    try:
+        # Callers compare quantity as a number, so coerce values like "3"
+        book_intent = parsed["book_intent"]
+        quantity, topic = int(book_intent["quantity"]), book_intent["topic"]
+        if not isinstance(topic, str):
+            raise TypeError("topic must be a string")
+    except (KeyError, TypeError, ValueError):
+        print("Error: Gemini returned an invalid book_intent. Using default values.")
+        return chat_response, {"quantity": 0, "topic": "Null"}  # Fallback to default values
+    return chat_response, {"quantity": quantity, "topic": topic}
+
 def search_books(query: str) -> List[Dict]:
     """
     Search for books using the Gemini model and fetch details.
     """
-    prompt = (
-        f"You are a helpful book recommendation assistant. The user is looking for books about: '{query}'.\n\n"
-        "Please provide a markdown table with two columns: 'Title' and 'Author'. "
-        "Return only the table without any extra commentary. Give me 5 relevant books."
-    )
+    prompt = _SEARCH_PROMPT.format(query=query)
     
     result = model.invoke(prompt)
     table_text = result.content.strip()
     
     # Parse the markdown table
-    recommended_books = []
-    lines = table_text.split('\n')
-    if len(lines) >= 3:  # Has header, separator, and data
-        for line in lines[2:]:  # Skip header and separator
-            parts = [part.strip() for part in line.split('|') if part.strip()]
-            if len(parts) >= 2:
-                book_info = fetch_book_details(parts[0])  # Fetch details for each book
-                if book_info:
-                    recommended_books.append(book_info)
-    
-    return recommended_books
+    titles = [title for title, _ in _TABLE_ROW.findall(table_text) if _is_book_row(title)]
+
+    if not titles:
+        return []
+
+    # Fetch details for all books at once
+    results = _book_cache.get_many_or_fetch(titles, _request_books_details)
+
+    return [book_info for book_info in results if book_info]
 
 def fetch_book_details(title: str) -> Optional[Dict]:
     """
-    Fetch book details from Google Books API.
+    Fetch book details from Google Books API, serving repeated titles and misses from cache.
+    """
+    try:
+        return _book_cache.get_or_fetch(title, _request_book_details)
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error fetching book details: {str(e)}")
+        return None
+
+def _request_book_details(title: str) -> Optional[Dict]:
+    """
+    Request book details for a title from Google Books API.
+    Returns None when no book matches; HTTP and network errors are raised.
     """
-    url = f"https://www.googleapis.com/books/v1/volumes"
     params = {
         'q': title,
         'key': os.getenv("GOOGLE_BOOKS_API_KEY", "")
     }
     
+    response = SESSION.get(GOOGLE_BOOKS_URL, params=params, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    
+    data = orjson.loads(response.content)
+    items = data.get("items")
+    if not items:
+        return None
+    
+    return _book_details_from_item(items[0])
+
+def _request_books_details(titles: List[str]) -> Dict[str, Optional[Dict]]:
+    """
+    Request details for several titles with one Google Books query (intitle:A OR intitle:B ...).
+    Titles without a close match among the returned volumes are looked up one by one, in parallel;
+    titles whose lookup failed are left out of the result, so they are not cached as misses.
+    """
+    params = {
+        'q': " OR ".join('intitle:"{}"'.format(title.replace('"', '')) for title in titles),
+        'maxResults': 40,
+        'key': os.getenv("GOOGLE_BOOKS_API_KEY", "")
+    }
+
+    items = []
     try:
-        response = requests.get(url, params=params)
+        response = SESSION.get(GOOGLE_BOOKS_URL, params=params, timeout=HTTP_TIMEOUT)
         response.raise_for_status()
-        
-        data = response.json()
-        if "items" not in data:
-            return None
-        
-        volume_info = data["items"][0].get("volumeInfo", {})
-        sale_info = data["items"][0].get("saleInfo", {})
-        
-        details = {
-            "title": volume_info.get("title", "N/A"),
-            "author": ", ".join(volume_info.get("authors", [])) if volume_info.get("authors") else "N/A",
-            "publisher": volume_info.get("publisher", "N/A"),
-            "published_date": volume_info.get("publishedDate", "N/A"),
-            "description": volume_info.get("description", "N/A"),
-            "thumbnail": volume_info.get("imageLinks", {}).get("thumbnail", "N/A"),
-            "categories": ", ".join(volume_info.get("categories", [])) if volume_info.get("categories") else "N/A",
-            "price": get_price_info(sale_info)
-        }
-        return details
-        
-    except Exception as e:
+        items = orjson.loads(response.content).get("items", [])
+    except (requests.RequestException, ValueError) as e:
         print(f"Error fetching book details: {str(e)}")
-        return None
+
+    item_titles = [normalize_title(item.get("volumeInfo", {}).get("title", "")) for item in items]
+    results = {}
+    unmatched = []
+    for title in titles:
+        match = difflib.get_close_matches(normalize_title(title), item_titles, n=1, cutoff=0.8)
+        if match:
+            results[title] = _book_details_from_item(items[item_titles.index(match[0])])
+        else:
+            unmatched.append(title)
+
+    futures = {title: get_details_pool().submit(_request_book_details, title) for title in unmatched}
+    for title, future in futures.items():
+        try:
+            results[title] = future.result()
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error fetching book details: {str(e)}")
+    return results
+
+def _book_details_from_item(item: Dict) -> Dict:
+    """Build the book details dict from one Google Books volume."""
+    volume_info = item.get("volumeInfo") or {}
+    authors = volume_info.get("authors")
+    categories = volume_info.get("categories")
+    image_links = volume_info.get("imageLinks") or {}
+
+    return {
+        "title": volume_info.get("title", "N/A"),
+        "author": ", ".join(authors) if authors else "N/A",
+        "publisher": volume_info.get("publisher", "N/A"),
+        "published_date": volume_info.get("publishedDate", "N/A"),
+        "description": volume_info.get("description", "N/A"),
+        "thumbnail": image_links.get("thumbnail", "N/A"),
+        "categories": ", ".join(categories) if categories else "N/A",
+        "price": get_price_info(item.get("saleInfo") or {})
+    }
 
 def get_price_info(sale_info: Dict) -> str:
     """Get price information from sale info."""
@@ -210,12 +288,13 @@ def handle_user_request(user_id: str, request_text: str) -> Dict:
         
         # Get user details from Firebase
         user_ref = db.collection("users").document(user_id)
-        user_data = user_ref.get().to_dict() or {}
+        user_data = user_ref.get(field_paths=PURCHASE_USER_FIELDS).to_dict() or {}
 
         # Filter out books the user already owns
+        owned = set(user_data.get("owned_books", []))
         filtered_books = [
             book for book in found_books 
-            if book["title"] not in user_data.get("owned_books", [])
+            if book["title"] not in owned
         ]
 
         # Prepare purchase details for the requested quantity
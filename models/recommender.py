@@ -1,22 +1,29 @@
 import chromadb
 from chromadb.config import Settings
-from firebase_admin import firestore
-import firebase_admin
-from firebase_admin import credentials
+from bootstrap import db
 from datetime import datetime
-import os
 import time
 
-# Initialize Firebase
-cred = credentials.Certificate(os.getenv("FIREBASE_CREDENTIALS_PATH"))
-firebase_admin.initialize_app(cred)
-
-# Initialize Firestore client
-db = firestore.client()
-
 # Initialize ChromaDB client with settings
 client = chromadb.PersistentClient(path="./chroma_db")
 
+# Max document references per batched Firestore read
+GET_ALL_CHUNK_SIZE = 100
+
+# Max values Firestore accepts in one array-contains-any filter
+ARRAY_CONTAINS_ANY_LIMIT = 30
+
+def get_documents(book_ids, collection_name="books"):
+    """Fetch many Firestore documents in batched reads instead of one round trip per document."""
+    collection = db.collection(collection_name)
+    snapshots = []
+
+    for start in range(0, len(book_ids), GET_ALL_CHUNK_SIZE):
+        refs = [collection.document(book_id) for book_id in book_ids[start:start + GET_ALL_CHUNK_SIZE]]
+        snapshots.extend(db.get_all(refs))
+
+    return snapshots
+
 def get_user_profile(user_id: str):
     """Fetch user profile from Firestore."""
     user_ref = db.collection("users").document(user_id)
@@ -38,9 +45,8 @@ def get_book_categories(book_ids, collection_name="books"):
     """Retrieve book categories from Firestore."""
     categories = set()
 
-    for book_id in book_ids:
-        book_ref = db.collection(collection_name).document(book_id)
-        book_data = book_ref.get().to_dict() or {}
+    for snapshot in get_documents(book_ids, collection_name):
+        book_data = snapshot.to_dict() or {}
 
         # Extract categories as an array
         book_categories = book_data.get("Category", [])
@@ -64,11 +70,11 @@ def search_books_with_categories(categories: list):
     try:
         books_ref = db.collection("books")
         
-        for category in categories:
-            query = books_ref.where("Category", "array-contains", category)
-            books = query.get()
+        for start in range(0, len(categories), ARRAY_CONTAINS_ANY_LIMIT):
+            chunk = categories[start:start + ARRAY_CONTAINS_ANY_LIMIT]
+            query = books_ref.where("Category", "array-contains-any", chunk)
 
-            for book in books:
+            for book in query.stream():
                 matching_book_ids.add(book.id)
 
         print(f"Found {len(matching_book_ids)} matching books for categories: {categories}")
@@ -91,9 +97,12 @@ def get_book_details(book_ids):
     """Fetch book details from Firestore."""
     books = []
 
+    snapshots = {snapshot.id: snapshot for snapshot in get_documents(book_ids)}
+
+    # get_all does not preserve request order, so walk book_ids to keep the ranking stable
     for book_id in book_ids:
-        book_ref = db.collection("books").document(book_id)
-        book_data = book_ref.get().to_dict()
+        snapshot = snapshots.get(book_id)
+        book_data = snapshot.to_dict() if snapshot else None
 
         if book_data:
             book_data["id"] = book_id
@@ -121,9 +130,10 @@ def recommend_books(user_id: str):
     recommended_book_ids = search_books_with_categories(list(all_categories))
 
     # Exclude books the user already owns or has in their wishlist
+    excluded = set(user_profile["owned_books"]) | set(user_profile["wishlist"])
     filtered_book_ids = [
         book_id for book_id in recommended_book_ids
-        if book_id not in user_profile["owned_books"] and book_id not in user_profile["wishlist"]
+        if book_id not in excluded
     ]
 
     recommendations = get_book_details(filtered_book_ids)
@@ -1,94 +1,210 @@
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-import os
+from models._clients import (
+    EMBEDDING_DIMENSION,
+    HTTP_TIMEOUT,
+    get_details_pool,
+    get_genai_model,
+    get_http_session,
+    get_sentence_transformer,
+)
+from cachetools import TTLCache
+from threading import Lock
+import numpy as np
+from models._book_cache import BookDetailsCache
 import requests
 import json
+import orjson
+import re
+import time
 
 # Load environment variables
 load_dotenv()
 
-# Initialize the ChatGoogleGenerativeAI model (your RAG LLM)
-model = ChatGoogleGenerativeAI(
-    model=os.getenv("GENAI_MODEL", "gemini-1.5-flash"),
-    temperature=float(os.getenv("GENAI_TEMPERATURE", 0)),
-    max_tokens=int(os.getenv("GENAI_MAX_TOKENS", 1024)),
-    timeout=int(os.getenv("GENAI_TIMEOUT", 60)),
-    max_retries=int(os.getenv("GENAI_MAX_RETRIES", 5)),
+# One complete {"title": ..., "author": ...} object inside the streamed JSON array
+_BOOK_OBJECT = re.compile(r"\{[^{}]*\}")
+
+# Gemini prompt template, filled in with str.format
+_RECOMMEND_PROMPT = (
+    "You are a helpful book recommendation assistant. The user is looking for a book described as: '{user_query}'.\n\n"
+    "Return ONLY a JSON array of 5 books, each an object with the keys \"title\" and \"author\", "
+    "for example [{{\"title\": \"Dune\", \"author\": \"Frank Herbert\"}}]."
 )
 
-def generate_recommendations(user_query):
+# Pooled HTTP session for Google Books requests
+SESSION = get_http_session()
+
+# Google Books details keyed by normalized title; misses are remembered for a shorter time
+_book_cache = BookDetailsCache("searching")
+
+# Recommendations for earlier queries: exact matches on the normalized query, then close paraphrases
+RECOMMENDATION_CACHE_SIZE = 512
+RECOMMENDATION_TTL = 3600  # Seconds before a cached recommendation list is regenerated
+SEMANTIC_THRESHOLD = 0.95  # Min cosine similarity to reuse a paraphrased query's recommendations
+
+_recommendation_cache = TTLCache(maxsize=RECOMMENDATION_CACHE_SIZE, ttl=RECOMMENDATION_TTL)
+_semantic_embeddings = np.zeros((RECOMMENDATION_CACHE_SIZE, EMBEDDING_DIMENSION), dtype=np.float32)
+_semantic_expiry = np.zeros(RECOMMENDATION_CACHE_SIZE)
+_semantic_results = []
+_semantic_next = 0  # Ring-buffer slot the next query embedding is written to
+_recommendation_lock = Lock()
+
+def _normalize_query(user_query):
+    return " ".join(user_query.lower().split())
+
+def _embed_query(user_query):
+    # Unit-length embeddings, so a dot product is the cosine similarity
+    return get_sentence_transformer().encode(user_query, normalize_embeddings=True).astype(np.float32)
+
+def _similar_recommendations(embedding):
+    with _recommendation_lock:
+        if not _semantic_results:
+            return None
+
+        similarities = _semantic_embeddings[:len(_semantic_results)] @ embedding
+        similarities[_semantic_expiry[:len(_semantic_results)] < time.monotonic()] = -1
+        best = int(np.argmax(similarities))
+        if similarities[best] >= SEMANTIC_THRESHOLD:
+            return _semantic_results[best]
+    return None
+
+def _store_recommendations(key, embedding, books):
+    global _semantic_next
+    with _recommendation_lock:
+        _recommendation_cache[key] = books
+        _semantic_embeddings[_semantic_next] = embedding
+        _semantic_expiry[_semantic_next] = time.monotonic() + RECOMMENDATION_TTL
+        if _semantic_next < len(_semantic_results):
+            _semantic_results[_semantic_next] = books
+        else:
+            _semantic_results.append(books)
+        _semantic_next = (_semantic_next + 1) % RECOMMENDATION_CACHE_SIZE
+
+def generate_recommendations(user_query, on_book=None):
     """
     Generate book recommendations using the Gemini model.
     Returns a list of dictionaries with 'title' and 'author'.
+    Repeated or near-identical queries reuse earlier recommendations instead of calling the model.
+    If given, on_book(book) is called for each book as soon as it is known, while the rest still streams in.
     """
-    prompt = (
-        f"You are a helpful book recommendation assistant. The user is looking for a book described as: '{user_query}'.\n\n"
-        "Please provide a markdown table with two columns: 'Title' and 'Author'. "
-        "Return only the table without any extra commentary. Give me 5 books."
-    )
+    key = _normalize_query(user_query)
+    with _recommendation_lock:
+        books = _recommendation_cache.get(key)
+    embedding = None
+    if books is None:
+        # Only embed the query when the exact lookup misses
+        embedding = _embed_query(key)
+        books = _similar_recommendations(embedding)
+    if books is not None:
+        for book in books:
+            if on_book:
+                on_book(book)
+        return books
 
-    # Generate the recommendations using the model
-    result = model.invoke(prompt)
-    table_text = result.content.strip()
+    books = []
+    for book in _stream_recommendations(user_query):
+        books.append(book)
+        if on_book:
+            on_book(book)
+    if books:
+        _store_recommendations(key, embedding, books)
+    return books
 
-    # Parse the markdown table into a list of dictionaries
-    lines = table_text.split('\n')
-    if len(lines) < 3:
-        return []
-    else:
-        recommended_books = []
-        for line in lines[2:]:  # Skip the header and separator lines
-            parts = [part.strip() for part in line.split('|') if part.strip()]
-            if len(parts) >= 2:
-                recommended_books.append({"title": parts[0], "author": parts[1]})
-        return recommended_books
+def _parse_book(text):
+    """Turn one JSON object from the model into a book dict, or None if it is malformed."""
+    try:
+        book = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    title, author = book.get("title"), book.get("author")
+    if isinstance(title, str) and isinstance(author, str) and title.strip():
+        return {"title": title.strip(), "author": author.strip()}
+    return None
+
+def _stream_recommendations(user_query):
+    """Yield book recommendations from the Gemini model one by one while the JSON array is generated."""
+    prompt = _RECOMMEND_PROMPT.format(user_query=user_query)
+
+    # Stream from the shared ChatGoogleGenerativeAI model (your RAG LLM),
+    # created on first use so importing this module stays free of client setup
+    buffer = ""
+    for chunk in get_genai_model().stream(prompt, generation_config={"response_mime_type": "application/json"}):
+        buffer += chunk.content
+        consumed = 0
+        for match in _BOOK_OBJECT.finditer(buffer):
+            book = _parse_book(match.group())
+            if book:
+                yield book
+            consumed = match.end()
+        buffer = buffer[consumed:]
 
 def fetch_book_details(title):
     """
     Given a book title, this function fetches details from the Google Books API.
     It returns a dictionary with Title, Author, Publisher, Published Date,
     Description, Thumbnail, Category, and Price.
+    Repeated titles and misses are served from cache (see BookDetailsCache).
     """
-    url = f"https://www.googleapis.com/books/v1/volumes?q={title}"
-    resp = requests.get(url)
-    if resp.status_code == 200:
-        data = resp.json()
-        if "items" in data and len(data["items"]) > 0:
-            volume_info = data["items"][0].get("volumeInfo", {})
-            sale_info = data["items"][0].get("saleInfo", {})
-            details = {
-                "Title": volume_info.get("title", "N/A"),
-                "Author": ", ".join(volume_info.get("authors", [])) if volume_info.get("authors") else "N/A",
-                "Publisher": volume_info.get("publisher", "N/A"),
-                "Published Date": volume_info.get("publishedDate", "N/A"),
-                "Description": volume_info.get("description", "N/A"),
-                "Thumbnail": volume_info.get("imageLinks", {}).get("thumbnail", "N/A"),
-                "Category": ", ".join(volume_info.get("categories", [])) if volume_info.get("categories") else "N/A",
-            }
-            # Remove the model price verification. Simply set to "N/A" if not provided.
-            if "listPrice" in sale_info:
-                price_amount = sale_info["listPrice"].get("amount", "N/A")
-                currency = sale_info["listPrice"].get("currencyCode", "")
-                details["Price"] = f"{price_amount} {currency}".strip()
-            else:
-                details["Price"] = "N/A"
-            return details
-    return None
+    try:
+        return _book_cache.get_or_fetch(title, _request_book_details)
+    except (requests.RequestException, ValueError) as e:
+        # Not cached, so the title is looked up again on the next search
+        print(f"Error fetching book details for {title!r}: {e}")
+        return None
+
+def _request_book_details(title):
+    """
+    Request book details for a title from the Google Books API.
+    Returns None when no book matches; HTTP and network errors are raised.
+    """
+    url = "https://www.googleapis.com/books/v1/volumes"
+    # 429/5xx responses are retried by the session adapter before raising here
+    resp = SESSION.get(url, params={"q": title}, timeout=HTTP_TIMEOUT)
+    resp.raise_for_status()
+    data = orjson.loads(resp.content)
+
+    items = data.get("items")
+    if not items:
+        return None
+
+    item = items[0]
+    volume_info = item.get("volumeInfo") or {}
+    authors = volume_info.get("authors")
+    categories = volume_info.get("categories")
+    image_links = volume_info.get("imageLinks") or {}
+    # Remove the model price verification. Simply set to "N/A" if not provided.
+    list_price = (item.get("saleInfo") or {}).get("listPrice")
+    if list_price:
+        price = f"{list_price.get('amount', 'N/A')} {list_price.get('currencyCode', '')}".strip()
+    else:
+        price = "N/A"
+    return {
+        "Title": volume_info.get("title", "N/A"),
+        "Author": ", ".join(authors) if authors else "N/A",
+        "Publisher": volume_info.get("publisher", "N/A"),
+        "Published Date": volume_info.get("publishedDate", "N/A"),
+        "Description": volume_info.get("description", "N/A"),
+        "Thumbnail": image_links.get("thumbnail", "N/A"),
+        "Category": ", ".join(categories) if categories else "N/A",
+        "Price": price,
+    }
 
 def main_search(user_query):
     """
     Main function to handle the entire search process.
     Takes a user query, generates recommendations, fetches details, and returns the results.
     """
-    # Step 1: Generate book recommendations
-    recommended_books = generate_recommendations(user_query)
-
-    # Step 2: Fetch detailed information for each recommended book
-    book_details_list = []
-    for book in recommended_books:
-        details = fetch_book_details(book["title"])
-        if details:
-            book_details_list.append(details)
+    # Steps 1 and 2: Generate book recommendations, fetching detailed information for each
+    # recommended book in parallel as soon as the model has produced its row
+    futures = []
+    generate_recommendations(
+        user_query,
+        on_book=lambda book: futures.append(get_details_pool().submit(fetch_book_details, book["title"])),
+    )
+    book_details_list = [details for details in (future.result() for future in futures) if details]
 
     # Step 3: Return the fetched book details
-    return book_details_list
\ No newline at end of file
+    return book_details_list
+
+if __name__ == "__main__":
+    user_query = input("Enter a brief description of the book you want: ")
+    print(json.dumps(main_search(user_query), indent=2))
@@ -1,82 +1,285 @@
 import speech_recognition as sr
 from gtts import gTTS
 import pygame
+import asyncio
+import io
 import tempfile
 import os
 import queue
-import sys
-import requests
-from typing import Dict, Optional
+import re
+import hashlib
+import threading
+import numpy as np
 from models.searching import generate_recommendations
 
+try:
+    from faster_whisper import WhisperModel
+except ImportError:  # Fall back to Google Web Speech
+    WhisperModel = None
+
+try:
+    import webrtcvad
+except ImportError:  # Fall back to speech_recognition's fixed phrase limits
+    webrtcvad = None
+
+# Speech recognition runs on-device with faster-whisper (INT8 on CPU) when it is installed
+ASR_BACKEND = os.getenv("ASR_BACKEND", "whisper" if WhisperModel else "google")
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small.en")
+if ASR_BACKEND == "whisper" and WhisperModel is None:
+    raise ImportError("ASR_BACKEND=whisper requires the faster-whisper package (see requirements-optional.txt)")
+
+_whisper_model = None
+_whisper_lock = threading.Lock()
+
+def _get_whisper_model():
+    global _whisper_model
+    if _whisper_model is None:
+        with _whisper_lock:
+            if _whisper_model is None:
+                _whisper_model = WhisperModel(WHISPER_MODEL, device="cpu", compute_type="int8")
+    return _whisper_model
+
+def _transcribe_whisper(audio):
+    # Whisper expects 16 kHz mono float32 samples in [-1, 1]
+    samples = np.frombuffer(audio.get_raw_data(convert_rate=16000, convert_width=2), dtype=np.int16)
+    try:
+        # Segments are decoded lazily, so the join runs the actual transcription
+        segments, _ = _get_whisper_model().transcribe(samples.astype(np.float32) / 32768.0, beam_size=1)
+        text = " ".join(segment.text.strip() for segment in segments).strip()
+    except Exception as e:
+        # Reported like a recognition service error, so the session keeps going
+        raise sr.RequestError(f"Whisper transcription failed: {str(e)}") from e
+    if not text:
+        raise sr.UnknownValueError()
+    return text
+
+# VAD capture: 20 ms frames at 16 kHz, a phrase ends after 300 ms of silence
+VAD_SAMPLE_RATE = 16000
+VAD_FRAME_MS = 20
+VAD_FRAME_SAMPLES = VAD_SAMPLE_RATE * VAD_FRAME_MS // 1000
+VAD_END_SILENCE_FRAMES = 300 // VAD_FRAME_MS
+VAD_PREROLL_FRAMES = 200 // VAD_FRAME_MS  # Audio kept from just before speech was detected
+LISTEN_TIMEOUT = 5  # Seconds to wait for speech to start
+PHRASE_TIME_LIMIT = 10  # Max seconds of a single phrase
+
+def _listen_vad(source, vad):
+    """Capture one phrase from source, stopping as soon as webrtcvad hears the speaker go quiet."""
+    frames = []
+    started = False
+    silent = 0
+    waited = 0
+    max_wait = LISTEN_TIMEOUT * 1000 // VAD_FRAME_MS
+    max_phrase = PHRASE_TIME_LIMIT * 1000 // VAD_FRAME_MS
+
+    while True:
+        frame = source.stream.read(VAD_FRAME_SAMPLES)
+        speech = vad.is_speech(frame, VAD_SAMPLE_RATE)
+        frames.append(frame)
+
+        if not started:
+            if speech:
+                started = True
+            else:
+                frames = frames[-VAD_PREROLL_FRAMES:]
+                waited += 1
+                if waited >= max_wait:
+                    raise sr.WaitTimeoutError("listening timed out while waiting for phrase to start")
+            continue
+
+        silent = 0 if speech else silent + 1
+        if silent >= VAD_END_SILENCE_FRAMES or len(frames) >= max_phrase:
+            return sr.AudioData(b"".join(frames), VAD_SAMPLE_RATE, source.SAMPLE_WIDTH)
+
+# Whole-word voice commands, so e.g. "byelaw" or "nobody" don't match
+_EXIT_RE = re.compile(r"\b(?:exit|quit|goodbye|bye)\b", re.IGNORECASE)
+_YES_RE = re.compile(r"\b(?:yes|yeah)\b", re.IGNORECASE)
+_NO_RE = re.compile(r"\b(?:no|nope)\b", re.IGNORECASE)
+
+# Responses are spoken sentence by sentence, with at most this many gTTS requests in flight
+TTS_CONCURRENCY = 3
+_SENTENCE_END = re.compile(r"(?<=[^\d\s][.!?])\s+")  # Not after list numbers like "1."
+
+# Fixed prompts are synthesized once and kept in memory while running, and on disk across runs
+# when TTS_CACHE_DIR is set (e.g. ~/.cache/bookini/tts)
+TTS_CACHE_DIR = os.path.expanduser(os.getenv("TTS_CACHE_DIR", "")) or None
+CANNED_PHRASES = [
+    "Hello! How can I help you find books today?",
+    "I didn't hear anything. Please try again.",
+    "I couldn't understand that. Could you please repeat?",
+    "There was an error with the speech recognition service.",
+    "Goodbye! Have a great day!",
+    "I'm sorry, there was an error processing your request.",
+    "Would you like to proceed with the purchase? Please say yes or no.",
+    "No problem! Let me know if you'd like to search for different books.",
+    "I didn't catch that. Please say yes or no.",
+]
+_CANNED_SENTENCES = {
+    sentence for phrase in CANNED_PHRASES for sentence in _SENTENCE_END.split(phrase)
+}
+
+_canned_audio = {}  # Canned sentence -> MP3 bytes, filled from TTS_CACHE_DIR (if set) or gTTS
+
+def _tts_cache_path(text):
+    return os.path.join(TTS_CACHE_DIR, hashlib.sha1(text.encode("utf-8")).hexdigest() + ".mp3")
+
+def _gtts_bytes(text):
+    # gTTS does a blocking HTTP request; callers run this off the event loop
+    buffer = io.BytesIO()
+    gTTS(text=text, lang='en').write_to_fp(buffer)
+    return buffer.getvalue()
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def _write_cache_file(path, audio):
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=TTS_CACHE_DIR, delete=False, suffix='.part') as fp:
+        fp.write(audio)
+    os.replace(fp.name, path)  # Never expose a half-written file
+
 class VoiceQueryHandler:
     def __init__(self, handle_user_request_func):
         self.recognizer = sr.Recognizer()
-        self.microphone = sr.Microphone()
+        self.vad = webrtcvad.Vad(2) if webrtcvad else None
+        # webrtcvad only accepts 8/16/32/48 kHz audio
+        self.microphone = sr.Microphone(sample_rate=VAD_SAMPLE_RATE) if self.vad else sr.Microphone()
         self.handle_user_request = handle_user_request_func
         self.response_queue = queue.Queue()
-        pygame.mixer.init()
-        
-        with self.microphone as source:
-            self.recognizer.adjust_for_ambient_noise(source, duration=1)
+        # The mixer and the ambient-noise calibration are set up on first use
+        self._mixer_ready = False
+        self._calibrated = False
     
-    def listen_for_query(self):
+    async def listen_for_query(self):
         try:
-            with self.microphone as source:
-                print("Listening...")
-                audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=10)
-            
-            print("Processing speech...")
-            text = self.recognizer.recognize_google(audio)
+            # Microphone capture and recognition block, so they run off the event loop
+            text = await asyncio.to_thread(self._recognize)
             print(f"Recognized: {text}")
             return text
-            
+
         except sr.WaitTimeoutError:
-            self._speak("I didn't hear anything. Please try again.")
+            await self._speak("I didn't hear anything. Please try again.")
             return None
         except sr.UnknownValueError:
-            self._speak("I couldn't understand that. Could you please repeat?")
+            await self._speak("I couldn't understand that. Could you please repeat?")
             return None
         except sr.RequestError as e:
-            self._speak("There was an error with the speech recognition service.")
+            await self._speak("There was an error with the speech recognition service.")
             print(f"Error: {str(e)}")
             return None
-    
-    def _speak(self, text):
+
+    def _recognize(self):
+        with self.microphone as source:
+            # Only recognizer.listen uses the energy threshold; the VAD path needs no calibration
+            if not self.vad and not self._calibrated:
+                self.recognizer.adjust_for_ambient_noise(source, duration=1)
+                self._calibrated = True
+            print("Listening...")
+            if self.vad:
+                audio = _listen_vad(source, self.vad)
+            else:
+                audio = self.recognizer.listen(source, timeout=LISTEN_TIMEOUT, phrase_time_limit=PHRASE_TIME_LIMIT)
+
+        print("Processing speech...")
+        if ASR_BACKEND == "whisper":
+            return _transcribe_whisper(audio)
+        return self.recognizer.recognize_google(audio)
+
+    async def _speak(self, text):
+        # Synthesize sentences concurrently and play each as soon as it and the ones before it are ready,
+        # so playback starts after the first sentence instead of after the whole response
+        if not self._mixer_ready:
+            pygame.mixer.init()
+            self._mixer_ready = True
+
+        sentences = [sentence for sentence in _SENTENCE_END.split(text.strip()) if sentence]
+        semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
+        tasks = [asyncio.create_task(self._synthesize(sentence, semaphore)) for sentence in sentences]
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as fp:
-                temp_filename = fp.name
-            
-            tts = gTTS(text=text, lang='en')
-            tts.save(temp_filename)
-            
-            pygame.mixer.music.load(temp_filename)
+            for task in tasks:
+                audio = await task
+                if audio:
+                    await self._play(audio)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _synthesize(self, text, semaphore):
+        """Return the MP3 bytes for text, synthesized in memory."""
+        if text in _CANNED_SENTENCES:
+            return await self._synthesize_cached(text, semaphore)
+
+        async with semaphore:
+            try:
+                return await asyncio.to_thread(_gtts_bytes, text)
+            except Exception as e:
+                print(f"Error in text-to-speech: {str(e)}")
+                return None
+
+    async def _synthesize_cached(self, text, semaphore):
+        audio = _canned_audio.get(text)
+        if audio:
+            return audio
+
+        cache_path = _tts_cache_path(text) if TTS_CACHE_DIR else None
+        async with semaphore:
+            if cache_path and os.path.exists(cache_path):
+                try:
+                    audio = await asyncio.to_thread(_read_bytes, cache_path)
+                except OSError as e:
+                    print(f"Error reading cached speech: {str(e)}")
+
+            if not audio:
+                try:
+                    audio = await asyncio.to_thread(_gtts_bytes, text)
+                except Exception as e:
+                    print(f"Error in text-to-speech: {str(e)}")
+                    return None
+
+                if cache_path:
+                    try:
+                        await asyncio.to_thread(_write_cache_file, cache_path, audio)
+                    except OSError as e:
+                        # The audio is still played and kept in memory
+                        print(f"Error caching speech on disk: {str(e)}")
+
+        _canned_audio[text] = audio
+        return audio
+
+    async def _warm_tts_cache(self):
+        semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
+        await asyncio.gather(*(self._synthesize_cached(sentence, semaphore) for sentence in _CANNED_SENTENCES))
+
+    async def _play(self, audio):
+        try:
+            pygame.mixer.music.load(io.BytesIO(audio), "mp3")
             pygame.mixer.music.play()
             while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
-            
+                await asyncio.sleep(0.05)
+
             pygame.mixer.music.unload()
-        
+
         except Exception as e:
             print(f"Error in text-to-speech: {str(e)}")
-        finally:
-            if os.path.exists(temp_filename):
-                os.unlink(temp_filename)
-    
+
     def handle_voice_interaction(self, user_id):
-        self._speak("Hello! How can I help you find books today?")
+        asyncio.run(self._voice_interaction(user_id))
+
+    async def _voice_interaction(self, user_id):
+        warm_up = asyncio.create_task(self._warm_tts_cache())  # Referenced so it isn't garbage collected
+        await self._speak("Hello! How can I help you find books today?")
         
         while True:
-            query = self.listen_for_query()
+            query = await self.listen_for_query()
             if not query:
                 continue
                 
-            if any(exit_phrase in query.lower() for exit_phrase in ["exit", "quit", "goodbye", "bye"]):
-                self._speak("Goodbye! Have a great day!")
+            if _EXIT_RE.search(query):
+                await self._speak("Goodbye! Have a great day!")
                 break
             
             try:
-                result = self.handle_user_request(user_id, query)
+                result = await asyncio.to_thread(self.handle_user_request, user_id, query)
                 
                 if result.get("found_books"):
                     books = result["found_books"]
@@ -92,25 +295,24 @@ class VoiceQueryHandler:
                 else:
                     response = result.get("message", "I'm sorry, I couldn't process your request.")
                 
-                self._speak(response)
+                await self._speak(response)
                 
                 if result.get("purchase_details"):
-                    self._handle_purchase_confirmation(result["purchase_details"])
+                    await self._handle_purchase_confirmation(result["purchase_details"])
                     
             except Exception as e:
                 print(f"Error processing voice query: {str(e)}")
-                self._speak("I'm sorry, there was an error processing your request.")
+                await self._speak("I'm sorry, there was an error processing your request.")
     
-    def _handle_purchase_confirmation(self, purchase_details):
-        self._speak("Would you like to proceed with the purchase? Please say yes or no.")
+    async def _handle_purchase_confirmation(self, purchase_details):
+        await self._speak("Would you like to proceed with the purchase? Please say yes or no.")
         
         while True:
-            response = self.listen_for_query()
+            response = await self.listen_for_query()
             if not response:
                 continue
                 
-            response = response.lower()
-            if "yes" in response or "yeah" in response:
+            if _YES_RE.search(response):
                 total_price = sum(
                     float(detail["price"].split()[0]) 
                     for detail in purchase_details 
@@ -122,49 +324,30 @@ class VoiceQueryHandler:
                     "The purchase will be completed using your default payment method. "
                     "You'll receive an email confirmation shortly."
                 )
-                self._speak(confirmation)
+                await self._speak(confirmation)
                 break
                 
-            elif "no" in response or "nope" in response:
-                self._speak("No problem! Let me know if you'd like to search for different books.")
+            elif _NO_RE.search(response):
+                await self._speak("No problem! Let me know if you'd like to search for different books.")
                 break
             
             else:
-                self._speak("I didn't catch that. Please say yes or no.")
+                await self._speak("I didn't catch that. Please say yes or no.")
 
-def fetch_book_details(title: str) -> Optional[Dict]:
-    url = "https://www.googleapis.com/books/v1/volumes"
-    params = {'q': title, 'key': os.getenv("GOOGLE_BOOKS_API_KEY", "")}
-    
+def test_voice_interaction():
+    """Run a voice session against the real purchase request handler."""
+    from models.purchase import handle_user_request
+
+    voice_handler = VoiceQueryHandler(handle_user_request)
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        
-        data = response.json()
-        if "items" not in data:
-            return None
-        
-        volume_info = data["items"][0].get("volumeInfo", {})
-        sale_info = data["items"][0].get("saleInfo", {})
-        
-        details = {
-            "title": volume_info.get("title", "N/A"),
-            "author": ", ".join(volume_info.get("authors", [])) if volume_info.get("authors") else "N/A",
-            "publisher": volume_info.get("publisher", "N/A"),
-            "published_date": volume_info.get("publishedDate", "N/A"),
-            "description": volume_info.get("description", "N/A"),
-            "thumbnail": volume_info.get("imageLinks", {}).get("thumbnail", "N/A"),
-            "categories": ", ".join(volume_info.get("categories", [])) if volume_info.get("categories") else "N/A",
-            "price": sale_info.get("listPrice", {}).get("amount", "N/A")
-        }
-        return details
-        
+        voice_handler.handle_voice_interaction("test_user_123")
+    except KeyboardInterrupt:
+        print("\nVoice interaction terminated by user.")
     except Exception as e:
-        print(f"Error fetching book details: {str(e)}")
-        return None
-    
+        print(f"Error in voice interaction: {str(e)}")
+
 def main_voice():
-    handler = VoiceQueryHandler(lambda user_id, query: {"found_books": generate_recommendations(user_id, query)})
+    handler = VoiceQueryHandler(lambda user_id, query: {"found_books": generate_recommendations(query)})
     handler.handle_voice_interaction("test_user")    
 
 if __name__ == "__main__":